@@ -2,82 +2,257 @@ import streamlit as st
 import pandas as pd
 import sqlite3
 import os
+import logging
+from contextlib import closing
+
+from db_schema import DERIVED_TABLES, build_derived_objects
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
 
 st.set_page_config(page_title="Food Waste Management", layout="wide")
 
+logger = logging.getLogger(__name__)
+
 DB_FILE = 'food_wastage.db'
 
+# Connection tuning for the read-mostly dashboard workload
+SQLITE_READ_PRAGMAS = '''
+PRAGMA cache_size=-65536;
+PRAGMA temp_store=MEMORY;
+PRAGMA mmap_size=268435456;
+PRAGMA busy_timeout=5000;
+'''
+SQLITE_PRAGMAS = '''
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+''' + SQLITE_READ_PRAGMAS
+
+# Read-only, immutable URI for the query path; only setup_database writes
+DB_READ_URI = f"file:{DB_FILE}?mode=ro&immutable=1"
+# Read-only URI that still sees the WAL, for checking what setup_database loaded
+DB_CHECK_URI = f"file:{DB_FILE}?mode=ro"
+
+# Source CSV for each table, in load order
+CSV_TABLES = [
+    ('providers_data.csv', 'Providers'),
+    ('receivers_data.csv', 'Receivers'),
+    ('food_listings_data.csv', 'Food_Listings'),
+    ('claims_data.csv', 'Claims'),
+]
+# Columns the dashboard queries use, with explicit types so read_csv skips type
+# inference. Anything not listed here is not loaded into the database.
+CSV_DTYPES = {
+    'Providers': {'Provider_ID': 'int32', 'Name': 'string', 'Type': 'category',
+                  'City': 'category', 'Contact': 'string'},
+    'Receivers': {'Receiver_ID': 'int32', 'Name': 'string', 'City': 'category'},
+    'Food_Listings': {'Food_ID': 'int32', 'Quantity': 'int32', 'Provider_ID': 'int32',
+                      'Location': 'category', 'Meal_Type': 'category'},
+    'Claims': {'Claim_ID': 'int32', 'Food_ID': 'int32', 'Receiver_ID': 'int32', 'Status': 'category'},
+}
+CSV_CHUNKSIZE = 50_000
+
+def get_loaded_mtimes():
+    # CSV mtime each table was last loaded from, read without opening the
+    # database for writing. Empty if there is no database or _meta table yet.
+    if not os.path.exists(DB_FILE):
+        return {}
+    try:
+        with closing(sqlite3.connect(DB_CHECK_URI, uri=True)) as conn:
+            return dict(conn.execute("SELECT Table_Name, Source_Mtime FROM _meta").fetchall())
+    except sqlite3.Error:
+        return {}
+
 # --- 1. Database Creation & Data Loading ---
 # This function runs once on every app start to create the database
 @st.cache_resource
 def setup_database():
+    conn = None
+    db_ready = False
     try:
-        required_csvs = ['providers_data.csv', 'receivers_data.csv', 'food_listings_data.csv', 'claims_data.csv']
-        for csv_file in required_csvs:
+        for csv_file, _ in CSV_TABLES:
             if not os.path.exists(csv_file):
                 st.error(f"Required CSV file '{csv_file}' not found. Please ensure all CSVs are in the project folder.")
                 return None
-        
+
+        # Only reload tables whose CSV changed since it was last loaded
+        loaded_mtimes = get_loaded_mtimes()
+        stale_tables = [(csv_file, table) for csv_file, table in CSV_TABLES
+                        if loaded_mtimes.get(table) != os.path.getmtime(csv_file)]
+        if not stale_tables:
+            return True
+
         conn = sqlite3.connect(DB_FILE)
-        
-        providers_df = pd.read_csv('providers_data.csv')
-        receivers_df = pd.read_csv('receivers_data.csv')
-        food_listings_df = pd.read_csv('food_listings_data.csv')
-        claims_df = pd.read_csv('claims_data.csv')
+        conn.executescript(SQLITE_PRAGMAS)
+        conn.execute("CREATE TABLE IF NOT EXISTS _meta (Table_Name TEXT PRIMARY KEY, Source_Mtime REAL)")
 
-        food_listings_df['Expiry_Date'] = pd.to_datetime(food_listings_df['Expiry_Date'], errors='coerce')
-        claims_df['Timestamp'] = pd.to_datetime(claims_df['Timestamp'], errors='coerce')
-        
-        providers_df.to_sql('Providers', conn, if_exists='replace', index=False)
-        receivers_df.to_sql('Receivers', conn, if_exists='replace', index=False)
-        food_listings_df.to_sql('Food_Listings', conn, if_exists='replace', index=False)
-        claims_df.to_sql('Claims', conn, if_exists='replace', index=False)
+        for csv_file, table in stale_tables:
+            # Stream each CSV in chunks so only one chunk is held in memory
+            chunks = pd.read_csv(csv_file, chunksize=CSV_CHUNKSIZE, usecols=list(CSV_DTYPES[table]),
+                                 dtype=CSV_DTYPES[table])
+            for i, chunk in enumerate(chunks):
+                chunk.to_sql(table, conn, if_exists='replace' if i == 0 else 'append', index=False)
+
+        # Rebuild the derived objects and mark the loaded tables fresh in one
+        # transaction, so _meta is only updated once everything built from them exists
+        conn.execute("BEGIN")
+        build_derived_objects(conn)
+        conn.executemany("INSERT OR REPLACE INTO _meta VALUES (?, ?)",
+                         [(table, os.path.getmtime(csv_file)) for csv_file, table in stale_tables])
         conn.commit()
-        
-        conn.close()
-        return True # Return True on success
+        db_ready = True
     except Exception as e:
         st.error(f"Error during database setup: {e}")
-        return False # Return False on failure
+    finally:
+        if conn is not None:
+            # Discard any unfinished work, then fold the WAL back into the main
+            # file, since immutable readers never look at it
+            conn.rollback()
+            busy = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()[0]
+            conn.close()
+            if busy:
+                st.error(f"Could not checkpoint '{DB_FILE}': another connection is using it.")
+                db_ready = False
+    return db_ready # True on success, False on failure
 
 # --- 2. Database Connection & Query Functions ---
-def get_db_connection():
-    if not os.path.exists(DB_FILE):
-        if not setup_database():
-            return None
+# A single read-only connection is shared for the app's lifetime
+@st.cache_resource
+def get_conn():
+    db_ready = setup_database()
+    # False means setup failed part-way, so the file may be incomplete.
+    # None means the CSVs are missing, so fall back to an existing database.
+    if db_ready is False or (db_ready is None and not os.path.exists(DB_FILE)):
+        return None
     try:
-        conn = sqlite3.connect(DB_FILE)
-        return conn
+        conn = sqlite3.connect(DB_READ_URI, uri=True, check_same_thread=False, isolation_level=None)
+        conn.executescript(SQLITE_READ_PRAGMAS)
     except Exception as e:
         st.error(f"Error connecting to database: {e}")
         return None
+    # A database not built by setup_database lacks the tables the pages read
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    missing = [table for table in DERIVED_TABLES if table not in existing]
+    if missing:
+        st.error(f"Database '{DB_FILE}' is missing tables {', '.join(missing)}. "
+                 "Add the CSV files so the database can be rebuilt, or run build_db.py.")
+        conn.close()
+        return None
+    return conn
 
-@st.cache_data
-def run_query(query):
-    conn = get_db_connection()
+# Optional DuckDB read path: materializes results straight into DataFrames
+@st.cache_resource
+def get_duckdb_conn():
+    if duckdb is None or get_conn() is None:
+        return None
+    try:
+        conn = duckdb.connect()
+        conn.execute("INSTALL sqlite; LOAD sqlite;")
+        conn.execute(f"ATTACH '{DB_FILE}' AS food_db (TYPE sqlite, READ_ONLY)")
+        conn.execute("USE food_db")
+        return conn
+    except Exception as e:
+        logger.warning("DuckDB read path unavailable, using SQLite: %s", e)
+        return None
+
+# Bounded query cache: entries expire after an hour, oldest evicted beyond the limit.
+# Integer SUMs in the page queries are CAST to BIGINT: DuckDB returns HUGEINT for
+# SUM(BIGINT), which .df() turns into float64, while SQLite returns int64.
+QUERY_CACHE_TTL = 3600
+QUERY_CACHE_MAX_ENTRIES = 128
+
+@st.cache_data(ttl=QUERY_CACHE_TTL, max_entries=QUERY_CACHE_MAX_ENTRIES, show_spinner=False)
+def run_query(query, params=()):
+    duck_conn = get_duckdb_conn()
+    if duck_conn:
+        try:
+            return duck_conn.cursor().execute(query, list(params)).df()
+        except Exception as e:
+            logger.warning("DuckDB query failed, falling back to SQLite: %s\n%s", e, query)
+    conn = get_conn()
     if conn:
         try:
-            df = pd.read_sql_query(query, conn)
-            conn.close()
-            return df
+            return pd.read_sql_query(query, conn, params=params)
         except Exception as e:
             st.error(f"Error executing query: {e}")
-            conn.close()
             return pd.DataFrame()
     return pd.DataFrame()
 
+# Single-row results skip the DataFrame round trip
+@st.cache_data(ttl=QUERY_CACHE_TTL, max_entries=QUERY_CACHE_MAX_ENTRIES, show_spinner=False)
+def run_scalar(query, params=()):
+    conn = get_conn()
+    if conn:
+        try:
+            return conn.execute(query, params).fetchone()
+        except Exception as e:
+            st.error(f"Error executing query: {e}")
+    return None
+
+# Providers and receivers per city, computed in one pass for both pages
+CITY_COUNTS_QUERY = '''
+WITH p AS (
+    SELECT City, COUNT(DISTINCT Provider_ID) AS n FROM Providers GROUP BY City
+),
+r AS (
+    SELECT City, COUNT(DISTINCT Receiver_ID) AS n FROM Receivers GROUP BY City
+),
+cities AS (
+    SELECT City FROM p
+    UNION
+    SELECT City FROM r
+)
+SELECT c.City,
+       COALESCE(p.n, 0) AS Providers_Count,
+       COALESCE(r.n, 0) AS Receivers_Count
+FROM cities c
+LEFT JOIN p ON p.City = c.City
+LEFT JOIN r ON r.City = c.City;
+'''
+
+# Claims status share and top listing city, fetched together for the dashboard
+DASHBOARD_OVERVIEW_QUERY = '''
+WITH status AS (
+    SELECT Status, Percentage FROM summary_status_pct
+),
+top_city AS (
+    SELECT City, Listing_Count
+    FROM summary_city_listings
+    ORDER BY Listing_Count DESC
+    LIMIT 1
+)
+SELECT 'status' AS Kind, Status AS Label, Percentage AS Value FROM status
+UNION ALL
+SELECT 'top_city', City, Listing_Count FROM top_city;
+'''
+
+# Cap the per-city chart to keep the payload sent to the browser small
+TOP_CITIES_LIMIT = 25
+
+def slice_city_counts(city_counts, count_column, selected_city):
+    if city_counts.empty:
+        return city_counts
+    df = city_counts.loc[city_counts[count_column] > 0, ["City", count_column]]
+    if selected_city != 'All Cities':
+        df = df[df["City"] == selected_city]
+    df = df.sort_values(count_column, ascending=False).head(TOP_CITIES_LIMIT)
+    return df.astype({"City": "category"})
+
 # --- 3. Page Functions ---
 def show_dashboard_page(selected_city):
     st.header("📊 Main Dashboard")
+    city_params = (selected_city,) if selected_city != 'All Cities' else ()
+
+    overview = run_query(DASHBOARD_OVERVIEW_QUERY)
+    if overview.empty:
+        overview = pd.DataFrame(columns=["Kind", "Label", "Value"])
 
     st.subheader("10. Claims Status Distribution (Percentage)")
     st.info("This shows overall claims status and is not filtered by city selection.")
-    q10 = run_query('''
-    SELECT Status,
-            ROUND((COUNT(*) * 100.0) / (SELECT COUNT(*) FROM Claims), 2) AS Percentage
-    FROM Claims
-    GROUP BY Status;
-    ''')
+    q10 = (overview.loc[overview["Kind"] == "status", ["Label", "Value"]]
+           .rename(columns={"Label": "Status", "Value": "Percentage"}))
     if not q10.empty:
         st.dataframe(q10, use_container_width=True)
         st.bar_chart(q10.set_index("Status"))
@@ -86,52 +261,40 @@ def show_dashboard_page(selected_city):
 
     st.subheader("6. City with Highest Food Listings")
     st.info("This metric shows the city with the highest listings overall, not filtered by selection.")
-    q6 = run_query('''
-    SELECT Location AS City, COUNT(*) AS Listing_Count
-    FROM Food_Listings
-    GROUP BY Location
-    ORDER BY Listing_Count DESC
-    LIMIT 1;
-    ''')
+    q6 = overview[overview["Kind"] == "top_city"]
     if not q6.empty:
-        st.dataframe(q6, use_container_width=True)
+        col1, col2 = st.columns(2)
+        col1.metric("City", q6["Label"].iloc[0])
+        col2.metric("Listing Count", int(q6["Value"].iloc[0]))
     else:
         st.info("No food listings data available.")
 
     st.header("📈 Analysis & Insights")
     st.subheader("12. Most Claimed Meal Type")
-    q12_where = f"AND fl.Location = '{selected_city}'" if selected_city != 'All Cities' else ""
-    q12 = run_query(f'''
-    SELECT fl.Meal_Type, COUNT(c.Claim_ID) AS Claim_Count
-    FROM Claims c
-    JOIN Food_Listings fl ON c.Food_ID = fl.Food_ID
+    q12_where = "WHERE City = ?" if city_params else ""
+    q12 = run_scalar(f'''
+    SELECT Meal_Type, CAST(SUM(Claim_Count) AS BIGINT) AS Claim_Count
+    FROM summary_meal_claims
     {q12_where}
-    GROUP BY fl.Meal_Type
+    GROUP BY Meal_Type
     ORDER BY Claim_Count DESC
     LIMIT 1;
-    ''')
-    if not q12.empty:
-        st.dataframe(q12, use_container_width=True)
+    ''', city_params)
+    if q12:
+        col1, col2 = st.columns(2)
+        col1.metric("Meal Type", q12[0])
+        col2.metric("Claim Count", q12[1])
     else:
         st.info(f"No most claimed meal type data for selected city: {selected_city}.")
 
-def show_providers_page(selected_city):
+def show_providers_page(selected_city, city_counts):
     st.header("📍 Food Providers")
+    city_params = (selected_city,) if selected_city != 'All Cities' else ()
 
-    city_filter_providers = ""
-    if selected_city != 'All Cities':
-        city_filter_providers = f" WHERE p.City = '{selected_city}'"
-
-    st.subheader("1. Providers & Receivers per City")
-    q1 = run_query(f'''
-    SELECT
-        p.City,
-        COUNT(DISTINCT p.Provider_ID) AS Providers_Count
-    FROM Providers p
-    {city_filter_providers}
-    GROUP BY p.City
-    ORDER BY Providers_Count DESC;
-    ''')
+    # The chart is only capped when it shows every city
+    top_suffix = f" (Top {TOP_CITIES_LIMIT})" if selected_city == 'All Cities' else ""
+    st.subheader(f"1. Providers & Receivers per City{top_suffix}")
+    q1 = slice_city_counts(city_counts, "Providers_Count", selected_city)
     if not q1.empty:
         st.dataframe(q1, use_container_width=True)
         st.bar_chart(q1.set_index("City")[["Providers_Count"]])
@@ -139,14 +302,14 @@ def show_providers_page(selected_city):
         st.info(f"No data for selected city: {selected_city}.")
 
     st.subheader("2. Provider Type Contribution")
-    q2_where = f"WHERE City = '{selected_city}'" if selected_city != 'All Cities' else ""
+    q2_where = "WHERE City = ?" if city_params else ""
     q2 = run_query(f'''
     SELECT Type AS Provider_Type, COUNT(*) AS Total
     FROM Providers
     {q2_where}
     GROUP BY Type
     ORDER BY Total DESC;
-    ''')
+    ''', city_params)
     if not q2.empty:
         st.dataframe(q2, use_container_width=True)
         st.bar_chart(q2.set_index("Provider_Type"))
@@ -155,7 +318,7 @@ def show_providers_page(selected_city):
 
     st.subheader("3. Provider Contacts")
     if selected_city != 'All Cities':
-        q3 = run_query(f"SELECT Name, Contact FROM Providers WHERE City = '{selected_city}';")
+        q3 = run_query("SELECT Name, Contact FROM Providers WHERE City = ?;", city_params)
         if not q3.empty:
             st.dataframe(q3, use_container_width=True)
         else:
@@ -164,39 +327,30 @@ def show_providers_page(selected_city):
         st.info("Select a specific city from the dropdown to view provider contacts.")
     
     st.subheader("13. Total Quantity Donated by Each Provider (Top 10)")
-    q13_where = f"AND p.City = '{selected_city}'" if selected_city != 'All Cities' else ""
-    q13 = run_query(f'''
-    SELECT p.Name AS Provider_Name, SUM(fl.Quantity) AS Total_Quantity_Donated
-    FROM Providers p
-    JOIN Food_Listings fl ON p.Provider_ID = fl.Provider_ID
-    {q13_where}
-    GROUP BY p.Name
-    ORDER BY Total_Quantity_Donated DESC
-    LIMIT 10;
-    ''')
-    if not q13.empty:
-        st.dataframe(q13, use_container_width=True)
-        st.bar_chart(q13.set_index("Provider_Name"))
-    else:
-        st.info(f"No total quantity donated data for selected city: {selected_city}.")
+    if st.toggle("Show total quantity donated", key="show_q13"):
+        q13_where = "WHERE City = ?" if city_params else ""
+        q13 = run_query(f'''
+        SELECT Provider_Name, CAST(SUM(Total_Quantity_Donated) AS BIGINT) AS Total_Quantity_Donated
+        FROM summary_provider_quantity
+        {q13_where}
+        GROUP BY Provider_Name
+        ORDER BY Total_Quantity_Donated DESC
+        LIMIT 10;
+        ''', city_params)
+        if not q13.empty:
+            st.dataframe(q13, use_container_width=True)
+            st.bar_chart(q13.set_index("Provider_Name"))
+        else:
+            st.info(f"No total quantity donated data for selected city: {selected_city}.")
 
-def show_receivers_page(selected_city):
+def show_receivers_page(selected_city, city_counts):
     st.header("🫂 Food Receivers")
+    city_params = (selected_city,) if selected_city != 'All Cities' else ()
     
-    city_filter_receivers = ""
-    if selected_city != 'All Cities':
-        city_filter_receivers = f" WHERE r.City = '{selected_city}'"
-    
-    st.subheader("1. Providers & Receivers per City")
-    q1 = run_query(f'''
-    SELECT
-        r.City,
-        COUNT(DISTINCT r.Receiver_ID) AS Receivers_Count
-    FROM Receivers r
-    {city_filter_receivers}
-    GROUP BY r.City
-    ORDER BY Receivers_Count DESC;
-    ''')
+    # The chart is only capped when it shows every city
+    top_suffix = f" (Top {TOP_CITIES_LIMIT})" if selected_city == 'All Cities' else ""
+    st.subheader(f"1. Providers & Receivers per City{top_suffix}")
+    q1 = slice_city_counts(city_counts, "Receivers_Count", selected_city)
     if not q1.empty:
         st.dataframe(q1, use_container_width=True)
         st.bar_chart(q1.set_index("City")[["Receivers_Count"]])
@@ -204,16 +358,15 @@ def show_receivers_page(selected_city):
         st.info(f"No data for selected city: {selected_city}.")
         
     st.subheader("4. Top 5 Receivers by Claims Count")
-    q4_where = f"AND r.City = '{selected_city}'" if selected_city != 'All Cities' else ""
+    q4_where = "WHERE City = ?" if city_params else ""
     q4 = run_query(f'''
-    SELECT r.Name AS Receiver_Name, COUNT(c.Claim_ID) AS Claims_Count
-    FROM Claims c
-    JOIN Receivers r ON c.Receiver_ID = r.Receiver_ID
+    SELECT Receiver_Name, CAST(SUM(Claims_Count) AS BIGINT) AS Claims_Count
+    FROM summary_receiver_claims
     {q4_where}
-    GROUP BY r.Name
+    GROUP BY Receiver_Name
     ORDER BY Claims_Count DESC
     LIMIT 5;
-    ''')
+    ''', city_params)
     if not q4.empty:
         st.dataframe(q4, use_container_width=True)
         st.bar_chart(q4.set_index("Receiver_Name"))
@@ -221,36 +374,40 @@ def show_receivers_page(selected_city):
         st.info(f"No receiver claims data for selected city: {selected_city}.")
 
     st.subheader("11. Average Quantity Claimed per Receiver (Top 10)")
-    q11_where = f"AND r.City = '{selected_city}'" if selected_city != 'All Cities' else ""
-    q11 = run_query(f'''
-    SELECT r.Name AS Receiver_Name, ROUND(AVG(fl.Quantity), 2) AS Avg_Quantity_Claimed
-    FROM Claims c
-    JOIN Receivers r ON c.Receiver_ID = r.Receiver_ID
-    JOIN Food_Listings fl ON c.Food_ID = fl.Food_ID
-    WHERE c.Status = 'Completed'
-    {q11_where}
-    GROUP BY r.Name
-    ORDER BY Avg_Quantity_Claimed DESC
-    LIMIT 10;
-    ''')
-    if not q11.empty:
-        st.dataframe(q11, use_container_width=True)
-    else:
-        st.info(f"No average quantity claimed data for selected city: {selected_city}.")
+    if st.toggle("Show average quantity claimed", key="show_q11"):
+        q11_where = "WHERE City = ?" if city_params else ""
+        q11 = run_query(f'''
+        SELECT Receiver_Name,
+               ROUND(SUM(Total_Quantity) * 1.0 / SUM(Claim_Count), 2) AS Avg_Quantity_Claimed
+        FROM summary_receiver_quantity
+        {q11_where}
+        GROUP BY Receiver_Name
+        ORDER BY Avg_Quantity_Claimed DESC
+        LIMIT 10;
+        ''', city_params)
+        if not q11.empty:
+            st.dataframe(q11, use_container_width=True)
+        else:
+            st.info(f"No average quantity claimed data for selected city: {selected_city}.")
 
 
 def main():
     st.title("🍲 Food Waste Management Insights")
     
     st.sidebar.header("Filter Options")
-    all_cities_query = '''
-        SELECT DISTINCT City FROM Providers
-        UNION
-        SELECT DISTINCT Location FROM Food_Listings;
-    '''
-    all_cities_df = run_query(all_cities_query)
-    all_cities = ['All Cities'] + sorted(all_cities_df['City'].tolist())
+    # The city list is fixed for the session, so build it once
+    if 'all_cities' not in st.session_state:
+        all_cities_df = run_query("SELECT City FROM Cities;")
+        if all_cities_df.empty:
+            # Don't keep an empty list for the session; retry on the next rerun
+            all_cities = ['All Cities']
+        else:
+            all_cities = ['All Cities'] + sorted(all_cities_df['City'].tolist())
+            st.session_state['all_cities'] = all_cities
+    else:
+        all_cities = st.session_state['all_cities']
     selected_city = st.sidebar.selectbox("🌍 Select City to Filter Data:", all_cities)
+    city_counts = run_query(CITY_COUNTS_QUERY)
     
     st.sidebar.markdown("---")
     page_selection = st.sidebar.radio("Navigate Pages", ["Dashboard", "Providers", "Receivers"])
@@ -258,9 +415,18 @@ def main():
     if page_selection == "Dashboard":
         show_dashboard_page(selected_city)
     elif page_selection == "Providers":
-        show_providers_page(selected_city)
+        show_providers_page(selected_city, city_counts)
     elif page_selection == "Receivers":
-        show_receivers_page(selected_city)
+        show_receivers_page(selected_city, city_counts)
+
+    if st.sidebar.checkbox("Show cache debug info"):
+        with st.sidebar.expander("🛠️ Query Cache", expanded=True):
+            st.write(f"TTL: {QUERY_CACHE_TTL} s")
+            st.write(f"Max entries: {QUERY_CACHE_MAX_ENTRIES}")
+            if st.button("Clear query cache"):
+                run_query.clear()
+                run_scalar.clear()
+                st.success("Query cache cleared.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
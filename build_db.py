@@ -2,7 +2,30 @@ import pandas as pd
 import sqlite3
 import os
 
+from db_schema import build_derived_objects
+
 DB_FILE = 'food_wastage.db'
+CSV_CHUNKSIZE = 50_000
+
+# Explicit column types so read_csv skips type inference; dates are read as text
+CSV_DTYPES = {
+    'Providers': {'Provider_ID': 'int32', 'Name': 'string', 'Type': 'category',
+                  'Address': 'string', 'City': 'category', 'Contact': 'string'},
+    'Receivers': {'Receiver_ID': 'int32', 'Name': 'string', 'Type': 'category',
+                  'City': 'category', 'Contact': 'string'},
+    'Food_Listings': {'Food_ID': 'int32', 'Food_Name': 'category', 'Quantity': 'int32',
+                      'Expiry_Date': 'string',
+                      'Provider_ID': 'int32', 'Provider_Type': 'category', 'Location': 'category',
+                      'Food_Type': 'category', 'Meal_Type': 'category'},
+    'Claims': {'Claim_ID': 'int32', 'Food_ID': 'int32', 'Receiver_ID': 'int32', 'Status': 'category',
+               'Timestamp': 'string'},
+}
+# Date columns and their CSV formats. Some rows use '-' as the date separator,
+# so values are normalized to '/' before parsing, then stored as ISO 8601 text.
+DATE_COLUMNS = {
+    'Food_Listings': {'Expiry_Date': '%m/%d/%Y'},
+    'Claims': {'Timestamp': '%m/%d/%Y %H:%M'},
+}
 
 # Check if all required CSVs are present
 required_csvs = ['providers_data.csv', 'receivers_data.csv', 'food_listings_data.csv', 'claims_data.csv']
@@ -12,36 +35,57 @@ for csv_file in required_csvs:
         print("Please ensure you have all four CSV files downloaded and placed here.")
         exit()
 
-# Connect to SQLite database
-conn = sqlite3.connect(DB_FILE)
+def load_csv(csv_file, table):
+    # Stream the CSV in chunks so only one chunk is held in memory. Rows are
+    # inserted with executemany rather than to_sql, which commits on every call.
+    rows = 0
+    chunks = pd.read_csv(csv_file, chunksize=CSV_CHUNKSIZE, dtype=CSV_DTYPES[table])
+    for i, chunk in enumerate(chunks):
+        for column, date_format in DATE_COLUMNS.get(table, {}).items():
+            dates = pd.to_datetime(chunk[column].str.replace('-', '/'), format=date_format,
+                                   errors='coerce', cache=True)
+            chunk[column] = dates.dt.strftime('%Y-%m-%d %H:%M:%S')
+        if i == 0:
+            conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+            conn.execute(pd.io.sql.get_schema(chunk, table))
+        placeholders = ', '.join(['?'] * len(chunk.columns))
+        values = chunk.astype(object).where(chunk.notna(), None)
+        conn.executemany(f'INSERT INTO "{table}" VALUES ({placeholders})',
+                         values.itertuples(index=False, name=None))
+        rows += len(chunk)
+    print(f"Read {rows} rows from {csv_file}")
+
+# Connect to SQLite database; transactions are managed explicitly below
+conn = sqlite3.connect(DB_FILE, isolation_level=None)
+conn.execute('PRAGMA journal_mode=WAL')
 print(f"Connected to database file '{DB_FILE}'")
 
 # Load each CSV into a DataFrame and then into a SQL table
 try:
     print("Loading data from CSVs into the database...")
 
+    # Load all four tables in a single transaction
+    conn.execute('BEGIN IMMEDIATE')
+
+    # Clear the app's load record so it checks the CSVs again on next start
+    conn.execute('DROP TABLE IF EXISTS _meta')
+
     # Load and print info for providers data
-    providers_df = pd.read_csv('providers_data.csv')
-    print(f"Read {len(providers_df)} rows from providers_data.csv")
-    providers_df.to_sql('Providers', conn, if_exists='replace', index=False)
+    load_csv('providers_data.csv', 'Providers')
 
     # Load and print info for receivers data
-    receivers_df = pd.read_csv('receivers_data.csv')
-    print(f"Read {len(receivers_df)} rows from receivers_data.csv")
-    receivers_df.to_sql('Receivers', conn, if_exists='replace', index=False)
+    load_csv('receivers_data.csv', 'Receivers')
 
     # Load and print info for food listings data
-    food_listings_df = pd.read_csv('food_listings_data.csv')
-    print(f"Read {len(food_listings_df)} rows from food_listings_data.csv")
-    food_listings_df['Expiry_Date'] = pd.to_datetime(food_listings_df['Expiry_Date'], errors='coerce')
-    food_listings_df.to_sql('Food_Listings', conn, if_exists='replace', index=False)
+    load_csv('food_listings_data.csv', 'Food_Listings')
 
     # Load and print info for claims data
-    claims_df = pd.read_csv('claims_data.csv')
-    print(f"Read {len(claims_df)} rows from claims_data.csv")
-    claims_df['Timestamp'] = pd.to_datetime(claims_df['Timestamp'], errors='coerce')
-    claims_df.to_sql('Claims', conn, if_exists='replace', index=False)
-    
+    load_csv('claims_data.csv', 'Claims')
+
+    # Reloading drops the indexes along with the tables, and Cities and the
+    # summary tables are built from them, so rebuild those too
+    build_derived_objects(conn)
+
     conn.commit()
     print("\nData loaded and database created successfully!")
 
@@ -0,0 +1,94 @@
+import sqlite3
+
+# Indexes, the sidebar city list and the page summary tables. Everything here is
+# derived from the four base tables and must be rebuilt whenever they are reloaded.
+DERIVED_OBJECTS_SQL = '''
+-- Index the join/filter columns used by the page queries
+CREATE INDEX IF NOT EXISTS idx_fl_provider ON Food_Listings(Provider_ID);
+CREATE INDEX IF NOT EXISTS idx_fl_location ON Food_Listings(Location);
+CREATE INDEX IF NOT EXISTS idx_fl_food ON Food_Listings(Food_ID);
+CREATE INDEX IF NOT EXISTS idx_c_food ON Claims(Food_ID);
+CREATE INDEX IF NOT EXISTS idx_c_receiver ON Claims(Receiver_ID);
+CREATE INDEX IF NOT EXISTS idx_c_status ON Claims(Status);
+CREATE INDEX IF NOT EXISTS idx_p_city ON Providers(City);
+CREATE INDEX IF NOT EXISTS idx_r_city ON Receivers(City);
+
+DROP TABLE IF EXISTS Cities;
+CREATE TABLE Cities AS
+SELECT City FROM (
+    SELECT City FROM Providers
+    UNION
+    SELECT Location FROM Food_Listings
+) ORDER BY City;
+CREATE INDEX IF NOT EXISTS idx_cities ON Cities(City);
+
+-- Precompute the page aggregates, keyed by city where the page filters on it.
+-- Aggregates are CAST so the columns get a declared type; other readers
+-- such as DuckDB's sqlite scanner treat untyped columns as BLOB.
+DROP TABLE IF EXISTS summary_status_pct;
+CREATE TABLE summary_status_pct AS
+SELECT Status,
+       CAST(ROUND((COUNT(*) * 100.0) / (SELECT COUNT(*) FROM Claims), 2) AS REAL) AS Percentage
+FROM Claims
+GROUP BY Status;
+
+DROP TABLE IF EXISTS summary_city_listings;
+CREATE TABLE summary_city_listings AS
+SELECT Location AS City, CAST(COUNT(*) AS INTEGER) AS Listing_Count
+FROM Food_Listings
+GROUP BY Location;
+CREATE INDEX idx_scl_count ON summary_city_listings(Listing_Count);
+
+DROP TABLE IF EXISTS summary_meal_claims;
+CREATE TABLE summary_meal_claims AS
+SELECT fl.Location AS City, fl.Meal_Type, CAST(COUNT(c.Claim_ID) AS INTEGER) AS Claim_Count
+FROM Claims c
+JOIN Food_Listings fl ON c.Food_ID = fl.Food_ID
+GROUP BY fl.Location, fl.Meal_Type;
+CREATE INDEX idx_smc_city ON summary_meal_claims(City);
+
+DROP TABLE IF EXISTS summary_provider_quantity;
+CREATE TABLE summary_provider_quantity AS
+SELECT p.City, p.Name AS Provider_Name,
+       CAST(SUM(fl.Quantity) AS INTEGER) AS Total_Quantity_Donated
+FROM Providers p
+JOIN Food_Listings fl ON p.Provider_ID = fl.Provider_ID
+GROUP BY p.City, p.Name;
+CREATE INDEX idx_spq_city ON summary_provider_quantity(City);
+
+DROP TABLE IF EXISTS summary_receiver_claims;
+CREATE TABLE summary_receiver_claims AS
+SELECT r.City, r.Name AS Receiver_Name, CAST(COUNT(c.Claim_ID) AS INTEGER) AS Claims_Count
+FROM Claims c
+JOIN Receivers r ON c.Receiver_ID = r.Receiver_ID
+GROUP BY r.City, r.Name;
+CREATE INDEX idx_src_city ON summary_receiver_claims(City);
+
+-- AVG is not additive across cities, so keep the sum and count
+DROP TABLE IF EXISTS summary_receiver_quantity;
+CREATE TABLE summary_receiver_quantity AS
+SELECT r.City, r.Name AS Receiver_Name,
+       CAST(SUM(fl.Quantity) AS INTEGER) AS Total_Quantity,
+       CAST(COUNT(fl.Quantity) AS INTEGER) AS Claim_Count
+FROM Claims c
+JOIN Receivers r ON c.Receiver_ID = r.Receiver_ID
+JOIN Food_Listings fl ON c.Food_ID = fl.Food_ID
+WHERE c.Status = 'Completed'
+GROUP BY r.City, r.Name;
+CREATE INDEX idx_srq_city ON summary_receiver_quantity(City);
+
+ANALYZE;
+'''
+
+# Tables the dashboard reads that only exist once the derived objects are built
+DERIVED_TABLES = ['Cities', 'summary_status_pct', 'summary_city_listings', 'summary_meal_claims',
+                  'summary_provider_quantity', 'summary_receiver_claims', 'summary_receiver_quantity']
+
+def build_derived_objects(conn):
+    # Run statement by statement: executescript would commit the caller's open transaction
+    statement = ''
+    for line in DERIVED_OBJECTS_SQL.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            conn.execute(statement)
+            statement = ''